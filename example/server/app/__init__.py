@@ -9,22 +9,66 @@ Flask应用工厂
 3. 延迟初始化扩展（db等），更灵活
 
 create_app() 函数负责：
-1. 创建Flask实例
+1. 创建Flask实例（并换上基于 orjson 的JSON处理器）
 2. 加载配置
 3. 初始化数据库扩展
 4. 注册所有蓝图（Blueprint）
-5. 创建数据库表
+5. 注册 flask init-db 命令；开发环境下顺便创建数据库表（见 app/schema.py）
 ============================================================
 """
 from flask import Flask
+from flask.json.provider import DefaultJSONProvider
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import orjson
+import sqlite3
 
 # 在模块级别创建db实例，但不绑定到任何app
 # 这样其他模块可以 from app import db 来使用
 db = SQLAlchemy()
 
 
+class ORJSONProvider(DefaultJSONProvider):
+    """
+    基于 orjson 的JSON处理器
+
+    替换Flask默认的标准库 json 实现。jsonify()、request.get_json()
+    以及session cookie的序列化都会经过 app.json，换掉这一处就全部走C实现。
+    orjson 不支持缩进等参数，这里忽略传入的关键字参数，统一输出紧凑格式。
+    """
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default,
+                            option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragma(dbapi_connection, connection_record):
+    """
+    每个新建的SQLite连接都先调好性能参数
+
+    - journal_mode=WAL：写操作追加到WAL文件，读写互不阻塞，提交时fsync更少
+    - synchronous=NORMAL：WAL模式下只在检查点时fsync，断电最多丢最近的事务，不会损坏数据库
+    - mmap_size：用内存映射读取数据库文件（256MB），热点页不再走read()系统调用
+    - cache_size：页缓存加大到约64MB（负数表示KB）
+    - temp_store=MEMORY：临时表和排序用的临时数据放内存
+    """
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA mmap_size=268435456')
+    cursor.execute('PRAGMA cache_size=-64000')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.close()
+
+
 def create_app(config_name='default'):
     """
     应用工厂函数
@@ -38,12 +82,14 @@ def create_app(config_name='default'):
     app = Flask(__name__,
                 template_folder='templates',
                 static_folder='static')
+    app.json = ORJSONProvider(app)
 
     # 从配置对象加载配置
     from config import config as config_dict
     app.config.from_object(config_dict[config_name])
 
     # 初始化扩展
+    # SQLite连接参数由模块顶部的 set_sqlite_pragma 在每次建立连接时设置
     db.init_app(app)          # 数据库ORM
     CORS(app)                 # 跨域支持
 
@@ -54,9 +100,12 @@ def create_app(config_name='default'):
     app.register_blueprint(main_bp)                    # 主页面路由
     app.register_blueprint(api_bp, url_prefix='/api')  # API路由，统一加 /api 前缀
 
-    # 在应用上下文中创建所有数据库表
-    with app.app_context():
-        from app import models  # 确保模型被导入，这样db才知道要创建哪些表
-        db.create_all()
+    # 数据库建表/升级：生产环境由 flask init-db 在启动 worker 之前执行一次，
+    # 开发环境只有一个进程，启动时直接执行
+    from app.schema import init_db, init_db_command
+    app.cli.add_command(init_db_command)
+    if app.config['AUTO_INIT_DB']:
+        with app.app_context():
+            init_db()
 
     return app
@@ -12,11 +12,40 @@
    用于追踪用户的学习轨迹，为推荐算法提供输入
 3. ChatHistory - 保存AI对话历史
    方便用户回顾之前的问答，也用于分析用户的知识薄弱点
+4. KnowledgeLine / UserMark - 知识点-代码行映射 和 用户标注的代码行
+   两张表一关联就能在SQL里按知识点统计标注数，不用在Python里逐行判断
 ============================================================
 """
 from app import db
 from datetime import datetime
 
+import orjson
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.mutable import MutableDict, MutableList
+from sqlalchemy.types import Text, TypeDecorator
+
+
+class JSONEncodedType(TypeDecorator):
+    """
+    JSON字段类型：数据库里仍然存Text，Python里直接是list/dict
+
+    写库时 orjson.dumps 序列化一次，读库时 orjson.loads 解析一次，
+    解析结果留在实例上，之后的读取就是普通的属性访问，
+    接口里不用再反复 json.loads / json.dumps。
+    """
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return orjson.dumps(value).decode('utf-8')
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return orjson.loads(value)
+
 
 class UserProfile(db.Model):
     """
@@ -30,38 +59,51 @@ class UserProfile(db.Model):
     session_id = db.Column(db.String(64), unique=True, nullable=False, index=True)
     # 累计查看的排序步骤数
     total_steps_viewed = db.Column(db.Integer, default=0)
-    # 标记过疑问的代码行号列表，用JSON字符串存储，如 "[3,5,12]"
-    marked_lines = db.Column(db.Text, default='[]')
+    # 标记过疑问的代码行号列表，库里存JSON字符串，如 "[3,5,12]"
+    # MutableList 会跟踪 append 等原地修改，提交时自动写回
+    marked_lines = db.Column(MutableList.as_mutable(JSONEncodedType), default=list)
     # 累计向AI提问的次数
     questions_asked = db.Column(db.Integer, default=0)
-    # 提问涉及的知识点列表，JSON字符串，如 '["分治思想","递归调用"]'
-    question_topics = db.Column(db.Text, default='[]')
+    # 按知识点汇总的标注行数，如 '{"基准选择":2}'，在 /mark 时增量维护
+    marked_counts = db.Column(MutableDict.as_mutable(JSONEncodedType), default=dict)
+    # 提问涉及的知识点及次数，如 '{"复杂度分析":3,"递归调用":1}'，在 /chat 时增量维护
+    # 只按主题计数，不保存每次提问，大小不随提问次数增长
+    topic_counts = db.Column(MutableDict.as_mutable(JSONEncodedType), default=dict)
     # 完成排序的次数
     completed_runs = db.Column(db.Integer, default=0)
     # 各知识点掌握度，JSON字符串，如 '{"分治思想":60,"基准选择":40,...}'
-    skill_scores = db.Column(db.Text, default='{}')
+    skill_scores = db.Column(MutableDict.as_mutable(JSONEncodedType), default=dict)
+    # skill_scores 是否需要重新计算：标注、提问、同步画像后置为True，/analyze 计算后清除
+    scores_dirty = db.Column(db.Boolean, default=True, index=True)
+    # 计算 skill_scores 时使用的动画总步骤数，前端传入的值变了也要重新计算
+    scores_total_steps = db.Column(db.Integer)
     # 创建和更新时间
     created_at = db.Column(db.DateTime, default=datetime.now)
     updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
 
-    # 关联的学习记录和对话历史
-    learning_records = db.relationship('LearningRecord', backref='user', lazy=True)
-    chat_histories = db.relationship('ChatHistory', backref='user', lazy=True)
+    # 关联的学习记录和对话历史，按时间先后排列
+    # selectin：加载多个用户时用一条 IN 查询批量取出子记录，避免 N+1 查询
+    learning_records = db.relationship('LearningRecord', back_populates='user', lazy='selectin',
+                                       order_by='LearningRecord.created_at')
+    chat_histories = db.relationship('ChatHistory', back_populates='user', lazy='selectin',
+                                     order_by='ChatHistory.created_at')
 
     def to_dict(self):
         """将模型对象转为字典，方便JSON序列化返回给前端"""
-        import json
         return {
             'id': self.id,
             'session_id': self.session_id,
             'total_steps_viewed': self.total_steps_viewed,
-            'marked_lines': json.loads(self.marked_lines),
+            'marked_lines': self.marked_lines,
             'questions_asked': self.questions_asked,
-            'question_topics': json.loads(self.question_topics),
+            # 提问涉及过的知识点列表（去重），由 topic_counts 得出
+            'question_topics': list(self.topic_counts),
+            'topic_counts': self.topic_counts,
             'completed_runs': self.completed_runs,
-            'skill_scores': json.loads(self.skill_scores),
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'skill_scores': self.skill_scores,
+            # datetime 直接交给 orjson 序列化为ISO格式字符串
+            'created_at': self.created_at,
+            'updated_at': self.updated_at,
         }
 
 
@@ -71,6 +113,8 @@ class LearningRecord(db.Model):
     每次用户的一个学习行为（标注代码行、完成排序等）记录一条
     """
     __tablename__ = 'learning_record'
+    # 按用户+时间的联合索引，查询某个用户的学习轨迹时直接走索引
+    __table_args__ = (db.Index('ix_lr_user_created', 'user_id', 'created_at'),)
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user_profile.id'), nullable=False)
@@ -80,13 +124,16 @@ class LearningRecord(db.Model):
     action_data = db.Column(db.Text, default='{}')
     created_at = db.Column(db.DateTime, default=datetime.now)
 
+    # 所属用户。raise_on_sql：只允许从已加载的数据(identity map)里取，
+    # 逐条记录去查用户这种 N+1 写法会直接报错
+    user = db.relationship('UserProfile', back_populates='learning_records', lazy='raise_on_sql')
+
     def to_dict(self):
-        import json
         return {
             'id': self.id,
             'action_type': self.action_type,
-            'action_data': json.loads(self.action_data),
-            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'action_data': orjson.loads(self.action_data),
+            'created_at': self.created_at,
         }
 
 
@@ -96,6 +143,8 @@ class ChatHistory(db.Model):
     保存用户和AI之间的每一轮对话
     """
     __tablename__ = 'chat_history'
+    # 按用户+时间的联合索引，查询某个用户的对话历史时直接走索引
+    __table_args__ = (db.Index('ix_ch_user_created', 'user_id', 'created_at'),)
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user_profile.id'), nullable=False)
@@ -107,11 +156,72 @@ class ChatHistory(db.Model):
     topic = db.Column(db.String(50), default='')
     created_at = db.Column(db.DateTime, default=datetime.now)
 
+    # 所属用户，同 LearningRecord.user
+    user = db.relationship('UserProfile', back_populates='chat_histories', lazy='raise_on_sql')
+
     def to_dict(self):
         return {
             'id': self.id,
             'question': self.question,
             'answer': self.answer,
             'topic': self.topic,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'created_at': self.created_at,
         }
+
+
+class KnowledgeLine(db.Model):
+    """
+    知识点-代码行映射表
+    内容与 recommendation.KNOWLEDGE_MAP 一致，初始化数据库时由 seed() 同步
+    """
+    __tablename__ = 'knowledge_line'
+
+    knowledge = db.Column(db.String(50), primary_key=True)
+    line = db.Column(db.Integer, primary_key=True, index=True)
+
+    @classmethod
+    def seed(cls, knowledge_map):
+        """
+        把映射表同步为 knowledge_map（知识点 -> 行号集合）
+
+        只插入缺少的行、删除已不在 knowledge_map 中的行，可以重复执行。
+        """
+        pairs = [(k, ln) for k, lines in knowledge_map.items() for ln in lines]
+        db.session.execute(db.delete(cls).where(db.tuple_(cls.knowledge, cls.line).not_in(pairs)))
+        if pairs:
+            db.session.execute(
+                sqlite_insert(cls).on_conflict_do_nothing(),
+                [{'knowledge': k, 'line': ln} for k, ln in pairs]
+            )
+        db.session.commit()
+
+
+class UserMark(db.Model):
+    """
+    用户标注表
+    每个用户标注过的每一行记录一条，(user_id, line) 唯一
+    """
+    __tablename__ = 'user_mark'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user_profile.id'), primary_key=True)
+    line = db.Column(db.Integer, primary_key=True)
+
+    @classmethod
+    def count_by_knowledge(cls, user_id):
+        """
+        按知识点统计某个用户的标注行数
+
+        user_mark 与 knowledge_line 按行号关联后分组计数，
+        匹配和计数都由SQLite在索引上完成。
+
+        返回:
+            dict: { '基准选择': 2, ... }，没有标注的知识点不出现
+        """
+        rows = db.session.execute(
+            db.select(KnowledgeLine.knowledge, db.func.count())
+            .select_from(cls)
+            .join(KnowledgeLine, KnowledgeLine.line == cls.line)
+            .where(cls.user_id == user_id)
+            .group_by(KnowledgeLine.knowledge)
+        )
+        return dict(rows.all())
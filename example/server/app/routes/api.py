@@ -8,6 +8,7 @@ api_bp 负责所有前端通过 fetch/AJAX 调用的JSON接口。
 2. /api/profile - 用户画像的保存和读取
 3. /api/analyze - 掌握度计算 + 个性化推荐生成
 4. /api/mark - 代码行标注的保存
+5. /api/history - 对话历史和学习记录的查询
 
 所有接口统一返回JSON格式：{ "success": true/false, "data": ... }
 
@@ -18,21 +19,41 @@ api_bp 负责所有前端通过 fetch/AJAX 调用的JSON接口。
 - mark: 标注数据需要持久化，且要关联到用户画像
 ============================================================
 """
-from flask import Blueprint, jsonify, request, session
-import json
+from flask import Blueprint, current_app, jsonify, request, session
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import raiseload, selectinload
+import hashlib
+import orjson
 
 from app import db
-from app.models import UserProfile, LearningRecord, ChatHistory
+from app.models import UserProfile, LearningRecord, ChatHistory, UserMark
 from app.utils.chat_engine import match_answer
 from app.utils.recommendation import (
     calculate_skill_scores, generate_recommendations,
-    KNOWLEDGE_MAP, KNOWLEDGE_GRAPH_RESOURCES, ADVICE_MAP
+    KNOWLEDGE_MAP, KNOWLEDGE_GRAPH_RESOURCES, ADVICE_MAP, LINE_TO_KNOWLEDGE
 )
 from app.utils.chat_engine import QA_KNOWLEDGE_BASE
 
 # 创建API蓝图，注册时会加上 /api 前缀
 api_bp = Blueprint('api', __name__)
 
+# 知识图谱接口返回的数据在运行期间不会变化，模块加载时序列化一次，
+# 并按内容算出 ETag，浏览器带 If-None-Match 再次请求时直接返回 304
+_KNOWLEDGE_PAYLOAD = orjson.dumps({
+    'success': True,
+    'knowledge_map': {k: sorted(lines) for k, lines in KNOWLEDGE_MAP.items()},
+    'resources': KNOWLEDGE_GRAPH_RESOURCES,
+    'advice_map': ADVICE_MAP,
+    'qa_knowledge_base': QA_KNOWLEDGE_BASE
+})
+_KNOWLEDGE_ETAG = hashlib.md5(_KNOWLEDGE_PAYLOAD).hexdigest()
+
+
+def is_line_number(value):
+    """行号必须是整数（bool 也是 int 的子类，要排除）"""
+    return type(value) is int
+
 
 def get_or_create_user():
     """
@@ -41,18 +62,57 @@ def get_or_create_user():
     通过 session 中的 session_id 识别用户。
     这是一个辅助函数，多个接口都需要用到。
 
+    第一次查到用户后把主键 uid 也存进 session，之后的请求直接按主键取，
+    同一个数据库会话里还能命中 SQLAlchemy 的 identity map，不用再发SQL。
+
+    接口只用到画像本身的字段，所以加载时用 raiseload 屏蔽关联的学习记录
+    和对话历史，既不会顺带查出子表，误访问时也会直接报错而不是悄悄发SQL。
+
+    新用户用一条 INSERT ... ON CONFLICT(session_id) DO NOTHING RETURNING 创建，
+    同一个 session_id 的并发请求不会因唯一约束冲突报错；没有插入说明用户已存在，再查一次即可。
+    不单独提交，和本次请求的其他修改一起在 commit_session 里提交。
+
     返回:
         UserProfile 模型实例
     """
     sid = session.get('session_id', 'anonymous')
-    user = UserProfile.query.filter_by(session_id=sid).first()
-    if not user:
-        user = UserProfile(session_id=sid)
-        db.session.add(user)
-        db.session.commit()
+
+    uid = session.get('uid')
+    if uid:
+        user = db.session.get(UserProfile, uid, options=[raiseload('*')])
+        if user and user.session_id == sid:
+            return user
+
+    user = db.session.scalars(
+        sqlite_insert(UserProfile)
+        .values(session_id=sid)
+        .on_conflict_do_nothing(index_elements=['session_id'])
+        .returning(UserProfile)
+        .options(raiseload('*'))
+    ).first()
+    if user is None:
+        user = db.session.scalars(
+            select(UserProfile).filter_by(session_id=sid).options(raiseload('*'))
+        ).one()
+    session['uid'] = user.id
     return user
 
 
+@api_bp.after_request
+def commit_session(response):
+    """
+    请求结束时统一提交一次数据库事务
+
+    各接口只负责修改数据，不再各自 commit。一个请求内的所有写操作
+    合并成一次提交，SQLite 每次提交都要落盘(fsync)，合并后写延迟更低。
+    只读请求的事务里没有写操作，提交时不会写盘，所以这里不必区分。
+    出错的响应（4xx/5xx）不提交，会话在请求结束时被回滚。
+    """
+    if response.status_code < 400:
+        db.session.commit()
+    return response
+
+
 @api_bp.route('/chat', methods=['POST'])
 def chat():
     """
@@ -89,14 +149,11 @@ def chat():
     )
     db.session.add(chat_record)
 
-    # 更新用户画像：提问次数+1，记录提问主题
+    # 更新用户画像：提问次数+1，对应主题的提问计数+1
     user.questions_asked += 1
     if topic:
-        topics = json.loads(user.question_topics)
-        topics.append(topic)
-        user.question_topics = json.dumps(topics, ensure_ascii=False)
-
-    db.session.commit()
+        user.topic_counts[topic] = user.topic_counts.get(topic, 0) + 1
+        user.scores_dirty = True
 
     return jsonify({
         'success': True,
@@ -113,12 +170,24 @@ def get_profile():
     响应体: { "success": true, "profile": { ... } }
 
     前端在页面加载时调用此接口，恢复用户之前的学习状态。
+
+    画像的任何修改都会刷新 updated_at，用它生成 ETag：
+    浏览器带着 If-None-Match 重新验证时，画像没变就直接返回 304，不再序列化。
+    因此 update_profile 收到和已存内容相同的数据时不能写库，否则 ETag 每次同步都会变。
     """
     user = get_or_create_user()
-    return jsonify({
-        'success': True,
-        'profile': user.to_dict()
-    })
+    etag = f'{user.id}-{user.updated_at.timestamp()}'
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify({
+            'success': True,
+            'profile': user.to_dict()
+        })
+    response.set_etag(etag)
+    # 允许缓存，但每次使用前都要带 ETag 回来验证
+    response.cache_control.no_cache = True
+    return response
 
 
 @api_bp.route('/profile', methods=['POST'])
@@ -138,18 +207,41 @@ def update_profile():
     data = request.get_json()
     if not data:
         return jsonify({'success': False, 'error': '请求体为空'}), 400
+    if 'marked_lines' in data and not (
+        isinstance(data['marked_lines'], list) and all(map(is_line_number, data['marked_lines']))
+    ):
+        return jsonify({'success': False, 'error': 'marked_lines参数格式错误'}), 400
 
     user = get_or_create_user()
 
-    # 更新各字段（只更新前端传来的字段）
-    if 'total_steps_viewed' in data:
-        user.total_steps_viewed = data['total_steps_viewed']
-    if 'marked_lines' in data:
-        user.marked_lines = json.dumps(data['marked_lines'], ensure_ascii=False)
-    if 'completed_runs' in data:
-        user.completed_runs = data['completed_runs']
-
-    db.session.commit()
+    # 更新各字段（只更新前端传来的、且和已存的值不同的字段）。
+    # 前端每次 /analyze 之前和关闭页面时都会同步一次，内容多半没变，
+    # 这时不写数据库，已缓存的掌握度和画像的 ETag 都继续有效
+    changed = False
+    for field in ('total_steps_viewed', 'completed_runs'):
+        if field in data and data[field] != getattr(user, field):
+            setattr(user, field, data[field])
+            changed = True
+    # 前端每次同步都会带上完整的标注列表，大多数时候和已存的一样，这时不碰标注表
+    if 'marked_lines' in data and data['marked_lines'] != user.marked_lines:
+        new_lines, old_lines = set(data['marked_lines']), set(user.marked_lines)
+        user.marked_lines = data['marked_lines']
+        changed = True
+        # 标注表只删掉去掉的行、补上新增的行，有变化时再在数据库里重新统计按知识点的汇总
+        removed, added = old_lines - new_lines, new_lines - old_lines
+        if removed:
+            db.session.execute(
+                db.delete(UserMark).where(UserMark.user_id == user.id, UserMark.line.in_(removed))
+            )
+        if added:
+            db.session.execute(
+                sqlite_insert(UserMark).on_conflict_do_nothing(),
+                [{'user_id': user.id, 'line': ln} for ln in added]
+            )
+        if removed or added:
+            user.marked_counts = UserMark.count_by_knowledge(user.id)
+    if changed:
+        user.scores_dirty = True
 
     return jsonify({'success': True})
 
@@ -164,34 +256,48 @@ def save_mark():
         "knowledge": "基准选择",
         "note": "不理解为什么选最后一个元素"
     }
+    也可以一次提交多条标注：[ { "line": 12, ... }, { "line": 17, ... } ]
     响应体: { "success": true }
 
     处理流程：
-    1. 保存标注到 LearningRecord 表（action_type='mark_line'）
-    2. 更新用户画像中的 marked_lines 列表
+    1. 保存标注到 LearningRecord 表（action_type='mark_line'），多条时批量写入
+    2. 记录到 UserMark 标注表
+    3. 更新用户画像中的 marked_lines 列表
     """
     data = request.get_json()
-    if not data or 'line' not in data:
+    marks = data if isinstance(data, list) else [data]
+    # 行号不是整数时按缺少参数处理
+    if not data or any(not isinstance(m, dict) or not is_line_number(m.get('line')) for m in marks):
         return jsonify({'success': False, 'error': '缺少line参数'}), 400
 
     user = get_or_create_user()
 
     # 保存学习记录
-    record = LearningRecord(
-        user_id=user.id,
-        action_type='mark_line',
-        action_data=json.dumps(data, ensure_ascii=False)
-    )
-    db.session.add(record)
-
-    # 更新用户画像中的标注行号列表
-    marked = json.loads(user.marked_lines)
-    line_num = data['line']
-    if line_num not in marked:
-        marked.append(line_num)
-        user.marked_lines = json.dumps(marked)
-
-    db.session.commit()
+    db.session.bulk_save_objects([
+        LearningRecord(
+            user_id=user.id,
+            action_type='mark_line',
+            action_data=orjson.dumps(mark).decode('utf-8')
+        )
+        for mark in marks
+    ])
+
+    # 写入标注表，已经标注过的行忽略；RETURNING 只返回这次真正新增的行号。
+    # 是否重复由 (user_id, line) 主键索引判断，不用在越来越长的 marked_lines 里线性查找
+    new_lines = db.session.execute(
+        sqlite_insert(UserMark)
+        .values([{'user_id': user.id, 'line': mark['line']} for mark in marks])
+        .on_conflict_do_nothing()
+        .returning(UserMark.line)
+    ).scalars().all()
+
+    # 新标注的行追加到用户画像的标注列表，同时计入所属知识点
+    for line_num in new_lines:
+        user.marked_lines.append(line_num)
+        knowledge = LINE_TO_KNOWLEDGE.get(line_num)
+        if knowledge:
+            user.marked_counts[knowledge] = user.marked_counts.get(knowledge, 0) + 1
+            user.scores_dirty = True
 
     return jsonify({'success': True})
 
@@ -212,6 +318,7 @@ def analyze():
     处理流程：
     1. 从数据库读取当前用户的画像数据
     2. 调用 calculate_skill_scores 计算各知识点掌握度
+       （上次计算后画像没有变化、总步骤数也相同时，直接使用保存的结果）
     3. 调用 generate_recommendations 生成个性化推荐
     4. 将计算结果保存回数据库
     5. 返回给前端展示
@@ -221,21 +328,22 @@ def analyze():
 
     user = get_or_create_user()
 
-    # 构建用户画像字典，传给计算函数
-    profile_dict = {
-        'total_steps_viewed': user.total_steps_viewed,
-        'marked_lines': json.loads(user.marked_lines),
-        'questions_asked': user.questions_asked,
-        'question_topics': json.loads(user.question_topics),
-        'completed_runs': user.completed_runs,
-    }
+    if user.scores_dirty or not user.skill_scores or user.scores_total_steps != total_steps:
+        # 构建用户画像字典，传给计算函数
+        profile_dict = {
+            'total_steps_viewed': user.total_steps_viewed,
+            'marked_counts': user.marked_counts,
+            'questions_asked': user.questions_asked,
+            'topic_counts': user.topic_counts,
+            'completed_runs': user.completed_runs,
+        }
 
-    # 调用后端算法计算掌握度
-    skill_scores = calculate_skill_scores(profile_dict, total_steps)
+        # 调用后端算法计算掌握度，并将计算结果保存到数据库
+        user.skill_scores = calculate_skill_scores(profile_dict, total_steps)
+        user.scores_total_steps = total_steps
+        user.scores_dirty = False
 
-    # 将计算结果保存到数据库
-    user.skill_scores = json.dumps(skill_scores, ensure_ascii=False)
-    db.session.commit()
+    skill_scores = user.skill_scores
 
     # 生成个性化推荐
     recommendations = generate_recommendations(skill_scores)
@@ -247,6 +355,42 @@ def analyze():
     })
 
 
+@api_bp.route('/history', methods=['GET'])
+def get_history():
+    """
+    获取当前用户的对话历史和学习记录
+
+    响应体: {
+        "success": true,
+        "chat_histories": [ { "question": "...", "answer": "...", "topic": "...", ... }, ... ],
+        "learning_records": [ { "action_type": "mark_line", "action_data": {...}, ... }, ... ]
+    }
+
+    用 selectinload 显式预加载两个关联集合：不管记录有多少条，
+    总共只有 查用户 + 查对话历史 + 查学习记录 三条SQL。
+    其余关联用 raiseload 屏蔽，漏写预加载时会直接报错。
+    """
+    sid = session.get('session_id', 'anonymous')
+    user = db.session.execute(
+        select(UserProfile)
+        .filter_by(session_id=sid)
+        .options(
+            selectinload(UserProfile.chat_histories),
+            selectinload(UserProfile.learning_records),
+            raiseload('*'),
+        )
+    ).scalar_one_or_none()
+
+    if not user:
+        return jsonify({'success': True, 'chat_histories': [], 'learning_records': []})
+
+    return jsonify({
+        'success': True,
+        'chat_histories': [h.to_dict() for h in user.chat_histories],
+        'learning_records': [r.to_dict() for r in user.learning_records],
+    })
+
+
 @api_bp.route('/knowledge', methods=['GET'])
 def get_knowledge():
     """
@@ -262,11 +406,12 @@ def get_knowledge():
 
     将原本硬编码在前端JS中的知识图谱数据、QA知识库等
     通过API暴露，前端不再需要维护这些重复数据。
+
+    响应体是启动时预先序列化好的 _KNOWLEDGE_PAYLOAD，
+    客户端缓存未过期或 ETag 匹配时不再重复传输。
     """
-    return jsonify({
-        'success': True,
-        'knowledge_map': KNOWLEDGE_MAP,
-        'resources': KNOWLEDGE_GRAPH_RESOURCES,
-        'advice_map': ADVICE_MAP,
-        'qa_knowledge_base': QA_KNOWLEDGE_BASE
-    })
+    response = current_app.response_class(_KNOWLEDGE_PAYLOAD, mimetype='application/json')
+    response.set_etag(_KNOWLEDGE_ETAG)
+    response.cache_control.public = True
+    response.cache_control.max_age = 3600
+    return response.make_conditional(request)
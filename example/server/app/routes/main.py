@@ -13,7 +13,7 @@ main_bp 负责页面级别的路由，即用户在浏览器地址栏输入URL后
 ============================================================
 """
 from flask import Blueprint, render_template, session
-import uuid
+import secrets
 
 # 创建蓝图实例
 # 第一个参数 'main' 是蓝图名称，用于 url_for('main.index') 这样的反向路由
@@ -29,7 +29,8 @@ def index():
     """
     # 如果用户还没有session_id，分配一个
     # session_id 存在Flask的session中（基于cookie），浏览器关闭前一直有效
+    # 8位十六进制随机串，直接取4字节安全随机数，不必生成完整UUID再截断
     if 'session_id' not in session:
-        session['session_id'] = str(uuid.uuid4())[:8]
+        session['session_id'] = secrets.token_hex(4)
 
     return render_template('quicksort.html', session_id=session['session_id'])
@@ -0,0 +1,166 @@
+"""
+数据库初始化与结构升级
+============================================================
+思路说明：
+建表、给旧数据库补字段、写入知识点-代码行映射，这些都只需要执行一次，
+不应该放在 create_app() 里让每个进程启动时都跑一遍：
+gunicorn 同时启动多个 worker 时，多个进程并发 create_all()
+会互相冲突（table already exists），导致 worker 启动失败。
+
+旧版本创建的数据库表缺少新加的字段（create_all 不会修改已存在的表），
+upgrade_schema() 负责补上这些字段，并用旧数据把新字段填好。
+
+因此统一放在 init_db() 中：
+- 开发环境（AUTO_INIT_DB=True）：create_app() 启动时自动调用，python run.py 即可使用
+- 生产环境：部署/升级时、启动 gunicorn 之前手动执行一次
+    flask --app wsgi init-db
+============================================================
+"""
+from collections import Counter
+
+import click
+import orjson
+from sqlalchemy import text
+
+from app import db
+
+
+def init_db():
+    """
+    创建数据库表并写入知识点-代码行映射
+
+    需要在应用上下文中调用，可以重复执行。
+    """
+    from app import models  # 确保模型被导入，这样db才知道要创建哪些表
+    from app.utils.recommendation import KNOWLEDGE_MAP
+
+    # 记下建表前已有哪些表，升级时据此判断哪些表是这次新建、需要用旧数据回填的
+    existing_tables = set(db.inspect(db.engine).get_table_names())
+    db.create_all()
+    upgrade_schema(existing_tables)
+    models.KnowledgeLine.seed(KNOWLEDGE_MAP)
+
+
+def upgrade_schema(existing_tables):
+    """
+    把旧版本的数据库升级到当前结构
+
+    参数:
+        existing_tables: 执行 create_all() 之前数据库中已有的表名
+
+    每一步都先检查字段/表是否已存在，已经升级过的数据库不会重复处理。
+    """
+    if 'user_profile' not in existing_tables:
+        return  # 全新的数据库，create_all() 建出来的就是当前结构
+
+    columns = {c['name'] for c in db.inspect(db.engine).get_columns('user_profile')}
+    _add_profile_counters(columns)
+    _backfill_user_marks(existing_tables)
+    _drop_question_topics(columns)
+    _add_score_cache_columns(columns)
+    _add_history_indexes()
+    db.session.commit()
+
+
+def _int_lines(marked_lines_json):
+    """从旧的 marked_lines JSON 中取出去重后的整数行号（旧接口不校验类型）"""
+    lines = orjson.loads(marked_lines_json or '[]')
+    return list(dict.fromkeys(ln for ln in lines if isinstance(ln, int) and not isinstance(ln, bool)))
+
+
+def _add_profile_counters(columns):
+    """
+    补上 marked_counts / topic_counts 两个汇总字段
+
+    marked_counts 由 marked_lines 统计，topic_counts 由旧的 question_topics 列表统计。
+    """
+    from app.utils.recommendation import count_marked_by_knowledge
+
+    if 'marked_counts' not in columns:
+        db.session.execute(text("ALTER TABLE user_profile ADD COLUMN marked_counts TEXT DEFAULT '{}'"))
+        rows = db.session.execute(text('SELECT id, marked_lines FROM user_profile')).all()
+        params = [
+            {'id': uid, 'counts': orjson.dumps(count_marked_by_knowledge(_int_lines(lines))).decode('utf-8')}
+            for uid, lines in rows
+        ]
+        if params:
+            db.session.execute(
+                text('UPDATE user_profile SET marked_counts = :counts WHERE id = :id'), params
+            )
+
+    if 'topic_counts' not in columns:
+        db.session.execute(text("ALTER TABLE user_profile ADD COLUMN topic_counts TEXT DEFAULT '{}'"))
+        if 'question_topics' in columns:
+            rows = db.session.execute(text('SELECT id, question_topics FROM user_profile')).all()
+            params = [
+                {'id': uid, 'counts': orjson.dumps(Counter(orjson.loads(topics or '[]'))).decode('utf-8')}
+                for uid, topics in rows
+            ]
+            if params:
+                db.session.execute(
+                    text('UPDATE user_profile SET topic_counts = :counts WHERE id = :id'), params
+                )
+
+
+def _backfill_user_marks(existing_tables):
+    """
+    user_mark 表是这次新建的，用各用户的 marked_lines 填充
+
+    /mark 靠 user_mark 的主键冲突判断某行是否已标注过，
+    不回填的话，升级前标注过的行会被再次追加并重复计数。
+    """
+    if 'user_mark' in existing_tables:
+        return
+    rows = db.session.execute(text('SELECT id, marked_lines FROM user_profile')).all()
+    params = [{'user_id': uid, 'line': ln} for uid, lines in rows for ln in _int_lines(lines)]
+    if params:
+        db.session.execute(
+            text('INSERT OR IGNORE INTO user_mark (user_id, line) VALUES (:user_id, :line)'), params
+        )
+
+
+def _drop_question_topics(columns):
+    """
+    删除旧的 question_topics 列表字段
+
+    提问主题改为只保存在 topic_counts 中，_add_profile_counters 已经把旧列表
+    换算进 topic_counts，必须在它之后执行。（DROP COLUMN 需要 SQLite 3.35+）
+    """
+    if 'question_topics' in columns:
+        db.session.execute(text('ALTER TABLE user_profile DROP COLUMN question_topics'))
+
+
+def _add_score_cache_columns(columns):
+    """
+    补上 scores_dirty / scores_total_steps 两个字段
+
+    旧数据都标记为需要重新计算，第一次 /analyze 时按当前画像算一遍。
+    """
+    if 'scores_dirty' not in columns:
+        db.session.execute(text('ALTER TABLE user_profile ADD COLUMN scores_dirty BOOLEAN DEFAULT 1'))
+        db.session.execute(text(
+            'CREATE INDEX IF NOT EXISTS ix_user_profile_scores_dirty ON user_profile (scores_dirty)'
+        ))
+    if 'scores_total_steps' not in columns:
+        db.session.execute(text('ALTER TABLE user_profile ADD COLUMN scores_total_steps INTEGER'))
+
+
+def _add_history_indexes():
+    """
+    给已存在的 learning_record / chat_history 表补上按用户+时间的联合索引
+
+    create_all() 只会给新建的表建索引，旧表上需要单独创建。
+    """
+    db.session.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_lr_user_created ON learning_record (user_id, created_at)'
+    ))
+    db.session.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_ch_user_created ON chat_history (user_id, created_at)'
+    ))
+
+
+@click.command('init-db')
+def init_db_command():
+    """创建/升级数据库表，部署时在启动 gunicorn 之前执行一次"""
+    init_db()
+    click.echo('数据库初始化完成')
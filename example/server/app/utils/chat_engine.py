@@ -11,11 +11,14 @@ AI对话知识库与匹配引擎
 4. 对话历史需要持久化到数据库，后端直接操作更方便
 
 匹配算法：
-当前使用关键词匹配（简单可靠），后续可升级为：
+当前使用关键词匹配（简单可靠）。所有关键词在模块加载时编译进一个
+Aho-Corasick 自动机，每个问题只需从头到尾扫描一遍，就能找出其中出现的全部关键词。
+后续可升级为：
 - TF-IDF 向量相似度
 - 接入大语言模型API
 ============================================================
 """
+import ahocorasick
 
 
 # 快速排序知识库
@@ -129,6 +132,28 @@ QA_KNOWLEDGE_BASE = [
 ]
 
 
+def _build_keyword_automaton(knowledge_base):
+    """
+    把知识库中所有关键词编译成 Aho-Corasick 自动机
+
+    每个关键词对应的值为 (关键词, 包含该关键词的条目下标元组)，
+    同一个关键词出现在多个条目里时，一次命中同时计入这些条目。
+    """
+    entries_by_kw = {}
+    for idx, qa in enumerate(knowledge_base):
+        for kw in qa['keywords']:
+            entries_by_kw.setdefault(kw, []).append(idx)
+
+    automaton = ahocorasick.Automaton()
+    for kw, idxs in entries_by_kw.items():
+        automaton.add_word(kw, (kw, tuple(idxs)))
+    automaton.make_automaton()
+    return automaton
+
+
+_KEYWORD_AUTOMATON = _build_keyword_automaton(QA_KNOWLEDGE_BASE)
+
+
 def match_answer(question):
     """
     关键词匹配回答
@@ -139,20 +164,21 @@ def match_answer(question):
         (answer, topic) 元组，answer是回答文本，topic是匹配到的知识点主题
 
     匹配原理：
-    遍历知识库中每个条目的关键词列表，统计用户问题中包含了多少个关键词，
-    选择匹配数最多的条目作为回答。如果没有任何匹配，返回通用引导回答。
+    用关键词自动机扫描一遍问题，统计每个条目有多少个不同的关键词出现在问题中，
+    选择匹配数最多的条目作为回答（匹配数相同时取知识库中靠前的条目）。
+    如果没有任何匹配，返回通用引导回答。
     """
     q = question.lower()
-    best_match = None
-    best_score = 0
 
-    for qa in QA_KNOWLEDGE_BASE:
-        score = sum(1 for kw in qa['keywords'] if kw in q)
-        if score > best_score:
-            best_score = score
-            best_match = qa
+    # 条目下标 -> 问题中出现的该条目关键词（同一关键词出现多次只算一次）
+    hits = {}
+    for _, (kw, idxs) in _KEYWORD_AUTOMATON.iter(q):
+        for idx in idxs:
+            hits.setdefault(idx, set()).add(kw)
 
-    if best_match and best_score > 0:
+    if hits:
+        best_idx = min(hits, key=lambda idx: (-len(hits[idx]), idx))
+        best_match = QA_KNOWLEDGE_BASE[best_idx]
         return best_match['answer'], best_match['topic']
 
     # 没有匹配到任何关键词，返回引导性回答
@@ -17,9 +17,14 @@
 ============================================================
 """
 
+import heapq
+from collections import Counter
+from functools import lru_cache
+from operator import itemgetter
+
 # 知识点与代码行号的映射关系
 # 这个映射定义了快速排序代码中每一行属于哪个知识点
-KNOWLEDGE_MAP = {
+_RAW_KNOWLEDGE_MAP = {
     '分治思想': [1, 2, 7, 8],
     '基准选择': [11, 12, 20, 21],
     '分区操作': [4, 10, 13, 14, 15, 16, 17, 18, 19, 22],
@@ -27,6 +32,18 @@ KNOWLEDGE_MAP = {
     '复杂度分析': [],  # 没有直接对应的代码行，通过提问行为推断
 }
 
+# 行号集合用 frozenset 存，判断"某行是否属于某知识点"是O(1)
+KNOWLEDGE_MAP = {k: frozenset(lines) for k, lines in _RAW_KNOWLEDGE_MAP.items()}
+
+# 知识点的固定顺序，掌握度计算按这个顺序逐个槽位进行
+KNOWLEDGE_ORDER = ('分治思想', '基准选择', '分区操作', '递归调用', '复杂度分析')
+# "复杂度分析"所在的槽位，它没有对应代码行，按提问次数额外加分
+_COMPLEXITY_SLOT = KNOWLEDGE_ORDER.index('复杂度分析')
+
+# 反向映射：代码行号 -> 知识点，模块加载时构建一次
+# 标注某一行时可以直接查到它属于哪个知识点
+LINE_TO_KNOWLEDGE = {ln: k for k, lines in _RAW_KNOWLEDGE_MAP.items() for ln in lines}
+
 # 知识图谱中的推荐资源
 # 每个知识点对应一个推荐的进阶学习内容
 KNOWLEDGE_GRAPH_RESOURCES = {
@@ -67,6 +84,63 @@ ADVICE_MAP = {
 }
 
 
+# 每个知识点推荐条目中固定不变的部分（建议内容、进阶推荐），模块加载时拼好，
+# 生成推荐时只需补上掌握度和难度标签
+RECOMMENDATION_PROTO = {
+    name: {
+        'knowledge': name,
+        'advice': ADVICE_MAP.get(name, ''),
+        **({
+            'next_topic': KNOWLEDGE_GRAPH_RESOURCES[name]['next'],
+            'next_difficulty': KNOWLEDGE_GRAPH_RESOURCES[name]['difficulty'],
+            'next_tip': KNOWLEDGE_GRAPH_RESOURCES[name]['tip'],
+        } if name in KNOWLEDGE_GRAPH_RESOURCES else {}),
+    }
+    for name in ADVICE_MAP.keys() | KNOWLEDGE_GRAPH_RESOURCES.keys()
+}
+
+# 掌握度 -> 难度标签，按分数阈值从高到低排列，取第一个满足的
+_TAGS = (
+    (70, '掌握良好', 'easy'),
+    (40, '需要加强', 'medium'),
+    (float('-inf'), '建议重点学习', 'hard'),
+)
+
+
+def count_marked_by_knowledge(marked_lines):
+    """
+    按知识点统计标注行数
+
+    参数:
+        marked_lines: 标记过疑问的行号列表
+    返回:
+        dict: { '基准选择': 2, ... }，没有标注的知识点不出现
+    """
+    counts = Counter()
+    for ln in marked_lines:
+        knowledge = LINE_TO_KNOWLEDGE.get(ln)
+        if knowledge:
+            counts[knowledge] += 1
+    return dict(counts)
+
+
+def _score(base, topic_asked, marked, complexity_q):
+    """
+    掌握度计算的数值核心，按 KNOWLEDGE_ORDER 的槽位逐个计算
+
+    参数:
+        base: 各知识点共同的分数（基础分 + 步骤加分 + 完成加分）
+        topic_asked: 各槽位是否提问过相关主题（0/1）
+        marked: 各槽位被标记疑问的行数
+        complexity_q: 提问"复杂度分析"的次数
+    返回:
+        list: 各槽位的掌握度，已限制在 0~100
+    """
+    scores = [base + 15 * asked - 10 * m for asked, m in zip(topic_asked, marked)]
+    scores[_COMPLEXITY_SLOT] += complexity_q * 10
+    return [0 if sc < 0 else 100 if sc > 100 else sc for sc in scores]
+
+
 def calculate_skill_scores(user_profile_dict, total_animation_steps=50):
     """
     计算各知识点的掌握度评分
@@ -74,10 +148,12 @@ def calculate_skill_scores(user_profile_dict, total_animation_steps=50):
     参数:
         user_profile_dict: 用户画像字典，包含以下字段：
             - total_steps_viewed: 查看的总步骤数
-            - marked_lines: 标记过疑问的行号列表
+            - marked_counts: 各知识点被标记疑问的行数 { '基准选择': 2, ... }
             - questions_asked: 提问次数
-            - question_topics: 提问涉及的主题列表
+            - topic_counts: 各知识点被提问的次数 { '复杂度分析': 3, ... }
             - completed_runs: 完成排序的次数
+            没有 marked_counts / topic_counts 时，也可以传原始的
+            marked_lines（行号列表）/ question_topics（主题列表），一次遍历汇总
         total_animation_steps: 动画总步骤数（前端传入，用于计算查看比例）
 
     返回:
@@ -86,8 +162,6 @@ def calculate_skill_scores(user_profile_dict, total_animation_steps=50):
     计算公式：
         掌握度 = 基础分(10) + 步骤加分(0~30) + 完成加分(0~30) + 提问加分(0~15) - 疑问扣分(每行10分)
     """
-    scores = {}
-
     # 基础分：用户开始学习就给10分底分
     total_viewed = user_profile_dict.get('total_steps_viewed', 0)
     base_score = 10 if total_viewed > 0 else 0
@@ -99,29 +173,25 @@ def calculate_skill_scores(user_profile_dict, total_animation_steps=50):
     completed = user_profile_dict.get('completed_runs', 0)
     complete_bonus = min(30, completed * 15)
 
-    marked_lines = user_profile_dict.get('marked_lines', [])
-    question_topics = user_profile_dict.get('question_topics', [])
-
-    for knowledge, lines in KNOWLEDGE_MAP.items():
-        score = base_score + step_bonus + complete_bonus
+    # 标注数和提问数已经在 /mark、/chat 时按知识点汇总好，这里直接查表
+    marked_counts = user_profile_dict.get('marked_counts')
+    if marked_counts is None:
+        marked_counts = count_marked_by_knowledge(user_profile_dict.get('marked_lines', []))
+    topic_counts = user_profile_dict.get('topic_counts')
+    if topic_counts is None:
+        topic_counts = Counter(user_profile_dict.get('question_topics', []))
 
-        # 提问加分：提问了相关主题 +15分
-        if knowledge in question_topics:
-            score += 15
+    # 按固定顺序把字典展开成槽位，交给 _score 做纯数值计算：
+    # 提问了相关主题 +15分；标注了该知识点的代码行，每行 -10分；
+    # "复杂度分析"没有对应代码行，通过提问次数评估，每次 +10分
+    scores = _score(
+        base_score + step_bonus + complete_bonus,
+        [1 if topic_counts.get(k, 0) > 0 else 0 for k in KNOWLEDGE_ORDER],
+        [marked_counts.get(k, 0) for k in KNOWLEDGE_ORDER],
+        topic_counts.get('复杂度分析', 0),
+    )
 
-        # 疑问扣分：标注了该知识点的代码行，每行 -10分
-        marked_count = sum(1 for ln in marked_lines if ln in lines)
-        score -= marked_count * 10
-
-        # 特殊处理"复杂度分析"：没有对应代码行，通过提问次数评估
-        if knowledge == '复杂度分析':
-            complexity_q_count = question_topics.count('复杂度分析')
-            score += complexity_q_count * 10
-
-        # 限制在 0~100
-        scores[knowledge] = max(0, min(100, score))
-
-    return scores
+    return dict(zip(KNOWLEDGE_ORDER, scores))
 
 
 def generate_recommendations(skill_scores, top_n=5):
@@ -137,38 +207,27 @@ def generate_recommendations(skill_scores, top_n=5):
 
     推荐算法：
         按掌握度从低到高排序，优先推荐掌握度最低的知识点
+
+    相同的掌握度得到的推荐总是一样的，结果按 (知识点, 分数) 元组缓存，
+    返回的是缓存条目的副本，调用方修改不会影响缓存。
     """
-    # 按掌握度从低到高排序
-    sorted_scores = sorted(skill_scores.items(), key=lambda x: x[1])
+    cached = _generate_recommendations(tuple(skill_scores.items()), top_n)
+    return [dict(rec) for rec in cached]
+
+
+@lru_cache(maxsize=1024)
+def _generate_recommendations(score_items, top_n):
+    """generate_recommendations 的计算部分，score_items 为 ((知识点, 分数), ...) 元组"""
+    # 取掌握度最低的 top_n 个（按分数从低到高），不需要对全部知识点排序
+    lowest = heapq.nsmallest(top_n, score_items, key=itemgetter(1))
 
     recommendations = []
-    for name, score in sorted_scores[:top_n]:
+    for name, score in lowest:
         # 根据掌握度确定难度标签
-        if score >= 70:
-            tag = '掌握良好'
-            tag_class = 'easy'
-        elif score >= 40:
-            tag = '需要加强'
-            tag_class = 'medium'
-        else:
-            tag = '建议重点学习'
-            tag_class = 'hard'
-
-        rec = {
-            'knowledge': name,
-            'score': score,
-            'tag': tag,
-            'tag_class': tag_class,
-            'advice': ADVICE_MAP.get(name, ''),
-        }
-
-        # 添加知识图谱中的进阶推荐
-        if name in KNOWLEDGE_GRAPH_RESOURCES:
-            resource = KNOWLEDGE_GRAPH_RESOURCES[name]
-            rec['next_topic'] = resource['next']
-            rec['next_difficulty'] = resource['difficulty']
-            rec['next_tip'] = resource['tip']
-
-        recommendations.append(rec)
-
-    return recommendations
+        tag, tag_class = next((t, c) for threshold, t, c in _TAGS if score >= threshold)
+
+        # 固定部分（建议内容、知识图谱中的进阶推荐）取预先拼好的条目
+        proto = RECOMMENDATION_PROTO.get(name) or {'knowledge': name, 'advice': ''}
+        recommendations.append({**proto, 'score': score, 'tag': tag, 'tag_class': tag_class})
+
+    return tuple(recommendations)
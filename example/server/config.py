@@ -18,6 +18,16 @@ class Config:
     # SQLite数据库文件放在instance目录下
     SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'instance', 'learning.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # 数据库连接池：复用连接，避免每个请求都重新打开SQLite文件
+    # pool_pre_ping 在取出连接前先探活，失效的连接会被自动替换
+    # check_same_thread=False 允许池里的连接被不同的请求线程复用
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'connect_args': {'check_same_thread': False},
+        'pool_size': 10,
+        'pool_pre_ping': True,
+    }
+    # 启动时是否自动建表/升级数据库（见 app/schema.py）
+    AUTO_INIT_DB = True
     # 知识图谱数据文件路径
     KNOWLEDGE_GRAPH_FILE = os.path.join(basedir, 'data', 'knowledge_graph.json')
 
@@ -30,6 +40,14 @@ class DevelopmentConfig(Config):
 class ProductionConfig(Config):
     """生产环境配置"""
     DEBUG = False
+    # 多个 worker 进程同时建表会冲突，部署时先执行一次 flask --app wsgi init-db
+    AUTO_INIT_DB = False
+    # 生产环境用 gunicorn + gevent 运行，并发请求更多，连接池相应加大
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        **Config.SQLALCHEMY_ENGINE_OPTIONS,
+        'pool_size': 20,
+        'max_overflow': 10,
+    }
 
 
 # 配置映射字典，通过字符串名称选择配置
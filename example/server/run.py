@@ -7,6 +7,10 @@
 然后在浏览器打开 http://localhost:5000
 
 使用应用工厂模式，通过 create_app() 创建应用实例。
+python run.py 使用的是Flask自带的开发服务器，单线程、仅用于本地调试。
+部署时请先初始化数据库，再用 gunicorn + gevent 运行 wsgi.py（见 wsgi.py 说明）：
+    flask --app wsgi init-db
+    gunicorn -k gevent -w 4 -b 0.0.0.0:5000 wsgi:application
 ============================================================
 """
 from app import create_app
@@ -19,5 +23,7 @@ if __name__ == '__main__':
     print('  快速排序算法学习推荐系统')
     print('  基于知识图谱的算法学习推荐系统')
     print('  打开浏览器访问: http://localhost:5000')
+    print('  (开发服务器，部署请先执行 flask --app wsgi init-db，')
+    print('   再用 gunicorn -k gevent -w 4 -b 0.0.0.0:5000 wsgi:application 启动)')
     print('=' * 50)
     app.run(debug=True, port=5000)
@@ -0,0 +1,26 @@
+"""
+生产环境入口文件
+============================================================
+思路说明：
+Flask自带的开发服务器是单线程的，并发用户只能排队处理，
+部署时改用 gunicorn 作为WSGI服务器：
+    flask --app wsgi init-db
+    gunicorn -k gevent -w 4 -b 0.0.0.0:5000 wsgi:application
+
+第一条命令建表/升级数据库，首次部署和每次升级代码后、启动 gunicorn 之前执行一次。
+生产配置下 create_app() 不再自动建表，避免多个 worker 同时建表互相冲突。
+
+-w 4：启动4个工作进程，充分利用多核处理JSON序列化等CPU工作
+-k gevent：每个请求在一个协程(greenlet)中处理，等待I/O时让出给其他请求
+
+gevent 需要在导入其他模块之前打猴子补丁，把标准库的socket等
+替换成协程友好的版本，所以 monkey.patch_all() 必须放在文件最顶部。
+============================================================
+"""
+from gevent import monkey
+monkey.patch_all()
+
+from app import create_app  # noqa: E402
+
+# 创建应用实例，使用生产环境配置
+application = create_app('production')